@@ -1,16 +1,24 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi.responses import JSONResponse, Response
 import os
 import uuid
 from pathlib import Path
-from typing import List
+from typing import List, BinaryIO, Optional
 import shutil
+import asyncio
+import hashlib
 import logging
 
-from ..models.image_analyzer import ImageAnalyzer
-from ..models.recipe_generator import RecipeGenerator
+import aiofiles
+import imagehash
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from ..models.image_analyzer import get_image_analyzer, image_analyzer_loaded
+from ..models.recipe_generator import RecipeGenerator, get_recipe_generator, recipe_generator_loaded
 from ..core.config import settings
-from ..utils.image_processing import validate_image, process_image
+from ..utils.image_processing import validate_image, process_image_bytes, run_image_task
+from ..utils.cache import LRUCache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,25 +26,91 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Initialize models (lazy loading)
-image_analyzer = None
-recipe_generator = None
-
-def get_image_analyzer():
-    """Get or initialize image analyzer"""
-    global image_analyzer
-    if image_analyzer is None:
-        logger.info("Initializing image analyzer...")
-        image_analyzer = ImageAnalyzer()
-    return image_analyzer
-
-def get_recipe_generator():
-    """Get or initialize recipe generator"""
-    global recipe_generator
-    if recipe_generator is None:
-        logger.info("Initializing recipe generator...")
-        recipe_generator = RecipeGenerator()
-    return recipe_generator
+# Chunk size for streaming uploads to disk (matches CPython's shutil default)
+COPY_BUFSIZE = 256 * 1024
+
+# Max Hamming distance between perceptual hashes to count as a near-duplicate
+PHASH_MAX_DISTANCE = 4
+
+# Analysis results keyed by a content hash of the upload, plus perceptual
+# hashes of the analyzed images for near-duplicate lookups
+analysis_cache = LRUCache(settings.analysis_cache_size)
+phash_cache = LRUCache(settings.analysis_cache_size)
+
+def models_ready() -> bool:
+    """Whether both models have finished loading"""
+    return image_analyzer_loaded() and recipe_generator_loaded()
+
+async def preload_models():
+    """Load both models in parallel worker threads"""
+    try:
+        logger.info("Preloading models...")
+        await asyncio.gather(
+            asyncio.to_thread(get_image_analyzer),
+            asyncio.to_thread(get_recipe_generator().load_model)
+        )
+        logger.info("All models loaded successfully")
+    except Exception as e:
+        logger.error(f"Error preloading models: {e}")
+
+def _sendfile_copy(src: BinaryIO, file_path: Path):
+    """Copy an on-disk upload to file_path in the kernel using sendfile"""
+    src_fd = src.fileno()
+    size = os.fstat(src_fd).st_size
+    with open(file_path, "wb") as buffer:
+        try:
+            offset = 0
+            while offset < size:
+                sent = os.sendfile(buffer.fileno(), src_fd, offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError:
+            # Filesystem doesn't support sendfile, fall back to a buffered copy
+            src.seek(0)
+            buffer.seek(0)
+            buffer.truncate()
+            shutil.copyfileobj(src, buffer, COPY_BUFSIZE)
+
+async def save_upload(file: UploadFile, file_path: Path):
+    """Write an uploaded file to disk without blocking the event loop"""
+    # Starlette spools large uploads to a real temporary file; those can be
+    # copied with a single sendfile call instead of going through userspace
+    if hasattr(os, "sendfile") and getattr(file.file, "_rolled", False):
+        await asyncio.to_thread(_sendfile_copy, file.file, file_path)
+        return
+    
+    async with aiofiles.open(file_path, "wb") as buffer:
+        while chunk := await file.read(COPY_BUFSIZE):
+            await buffer.write(chunk)
+
+async def _hash_upload(file: UploadFile) -> bytes:
+    """Content hash of an upload, enforcing the size limit as it's read
+    
+    The client-reported file.size isn't trusted (it's None for streamed
+    uploads). Starlette has already spooled the upload (to disk when it's
+    large), so it's only read here and rewound for processing.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    while chunk := await file.read(COPY_BUFSIZE):
+        size += len(chunk)
+        if size > settings.max_file_size:
+            raise HTTPException(status_code=413, detail="File too large")
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.digest()
+
+def _perceptual_hash(image: np.ndarray) -> int:
+    """64-bit perceptual hash of an image"""
+    return int(str(imagehash.phash(Image.fromarray(image))), 16)
+
+def _find_near_duplicate(phash: int) -> Optional[dict]:
+    """Return a cached analysis for a visually similar image, if any"""
+    for cached_hash, result in phash_cache.items():
+        if (cached_hash ^ phash).bit_count() <= PHASH_MAX_DISTANCE:
+            return result
+    return None
 
 @router.post("/analyze-image")
 async def analyze_image(file: UploadFile = File(...)):
@@ -48,45 +122,63 @@ async def analyze_image(file: UploadFile = File(...)):
         if not validate_image(file):
             raise HTTPException(status_code=400, detail="Invalid image file")
         
-        # Create upload directory if it doesn't exist
-        upload_dir = Path(settings.upload_dir)
-        upload_dir.mkdir(exist_ok=True)
+        # Hashing enforces the size limit, so it runs before anything is saved
+        cache_key = await _hash_upload(file)
         
-        # Save uploaded file
-        file_id = str(uuid.uuid4())
-        file_extension = Path(file.filename).suffix.lower() if file.filename else ".jpg"
-        file_path = upload_dir / f"{file_id}{file_extension}"
+        # Keep a copy of the upload on disk only when debugging
+        if settings.debug:
+            file_id = str(uuid.uuid4())
+            file_extension = Path(file.filename).suffix.lower() if file.filename else ".jpg"
+            file_path = Path(settings.upload_dir) / f"{file_id}{file_extension}"
+            
+            await save_upload(file, file_path)
+            await file.seek(0)
+            logger.info(f"Saved file to: {file_path}")
         
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Reuse the analysis of an identical upload
+        analysis_result = analysis_cache.get(cache_key)
+        if analysis_result is not None:
+            logger.info("Returning cached analysis result")
+            return JSONResponse(content=analysis_result)
         
-        logger.info(f"Saved file to: {file_path}")
+        # Decode and downscale the image in memory (PIL work runs on the image
+        # pool, off the event loop)
+        try:
+            image = await run_image_task(process_image_bytes, file.file)
+        except UnidentifiedImageError:
+            raise HTTPException(status_code=400, detail="Invalid image file")
         
-        # Process image
-        processed_path = process_image(str(file_path))
+        # Reuse the analysis of a near-duplicate image
+        phash = None
+        if settings.analysis_cache_near_duplicates:
+            phash = await run_image_task(_perceptual_hash, image)
+            analysis_result = _find_near_duplicate(phash)
+            if analysis_result is not None:
+                logger.info("Returning cached analysis result for similar image")
+                analysis_cache.put(cache_key, analysis_result)
+                return JSONResponse(content=analysis_result)
         
-        # Analyze image
-        analyzer = get_image_analyzer()
-        analysis_result = analyzer.analyze_image(processed_path)
+        # Analyze image (waiting for the model off the event loop if it's still loading)
+        analyzer = await asyncio.to_thread(get_image_analyzer)
+        analysis_result = await analyzer.analyze_image(image)
         
-        # Clean up files
-        try:
-            os.remove(file_path)
-            if processed_path != str(file_path):
-                os.remove(processed_path)
-        except Exception as e:
-            logger.warning(f"Error cleaning up files: {e}")
+        # Fallback captions come from a failed model call, so retry those next time
+        if analysis_result.get("success") and not analysis_result.get("fallback"):
+            analysis_cache.put(cache_key, analysis_result)
+            if phash is not None:
+                phash_cache.put(phash, analysis_result)
         
         logger.info(f"Analysis result: {analysis_result}")
         return JSONResponse(content=analysis_result)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing image: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 @router.post("/generate-recipes")
-async def generate_recipes(request: dict):
+async def generate_recipes(request: dict, generator: RecipeGenerator = Depends(get_recipe_generator)):
     """Generate recipes based on ingredients"""
     try:
         ingredients = request.get("ingredients", [])
@@ -95,39 +187,57 @@ async def generate_recipes(request: dict):
         if not ingredients:
             raise HTTPException(status_code=400, detail="No ingredients provided")
         
-        # Generate recipes
-        generator = get_recipe_generator()
-        recipes = generator.generate_recipes(ingredients)
-        
-        result = {
-            "success": True,
-            "recipes": recipes,
-            "total": len(recipes)
-        }
+        if settings.ai_recipes:
+            # AI generation is batched with other concurrent requests
+            recipes = await generator.generate_recipes_async(ingredients)
+            return JSONResponse(content={"success": True, "recipes": recipes, "total": len(recipes)})
+
+        # Generate recipes (already encoded as the JSON response body)
+        body = generator.generate_recipes_raw(ingredients)
         
-        logger.info(f"Generated {len(recipes)} recipes")
-        return JSONResponse(content=result)
+        return Response(content=body, media_type="application/json")
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating recipes: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating recipes: {str(e)}")
 
 @router.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint (liveness; answers while the models are still loading)"""
     return {
         "status": "healthy", 
         "message": "RecipeSnap API is running",
         "version": "1.0.0"
     }
 
+@router.get("/ready")
+async def readiness_check():
+    """Readiness endpoint (reports 503 until the models are loaded)"""
+    if not models_ready():
+        return JSONResponse(
+            status_code=503,
+            content={
+                "status": "loading",
+                "message": "RecipeSnap API is loading models",
+                "version": "1.0.0"
+            }
+        )
+    
+    return {
+        "status": "ready",
+        "message": "RecipeSnap API models are loaded",
+        "version": "1.0.0"
+    }
+
 @router.get("/models/status")
 async def models_status():
     """Check the status of AI models"""
     try:
         # Check if models are initialized
-        image_status = "loaded" if image_analyzer is not None else "not loaded"
-        recipe_status = "loaded" if recipe_generator is not None else "not loaded"
+        image_status = "loaded" if image_analyzer_loaded() else "not loaded"
+        recipe_status = "loaded" if recipe_generator_loaded() else "not loaded"
         
         return {
             "image_analyzer": image_status,
@@ -149,11 +259,11 @@ async def load_models():
     try:
         logger.info("Loading all models...")
         
-        # Load image analyzer
-        analyzer = get_image_analyzer()
-        
-        # Load recipe generator
-        generator = get_recipe_generator()
+        # Load both models in worker threads so the event loop keeps serving
+        await asyncio.gather(
+            asyncio.to_thread(get_image_analyzer),
+            asyncio.to_thread(get_recipe_generator().load_model)
+        )
         
         return {
             "status": "success",
@@ -178,6 +288,7 @@ async def root():
             "analyze_image": "/api/v1/analyze-image",
             "generate_recipes": "/api/v1/generate-recipes",
             "health": "/api/v1/health",
+            "ready": "/api/v1/ready",
             "models_status": "/api/v1/models/status"
         }
     } 
\ No newline at end of file
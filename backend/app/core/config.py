@@ -1,26 +1,52 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 import os
 
 class Settings(BaseSettings):
     app_name: str = "RecipeSnap API"
-    debug: bool = True
+    debug: bool = False  # Set DEBUG=true to keep copies of uploads
+    dev: bool = False  # Set DEV=1 to run a single auto-reloading worker
+    workers: int = max(2, os.cpu_count() or 1)  # Server worker processes (each loads its own copy of the models)
     upload_dir: str = "uploads"
     max_file_size: int = 10 * 1024 * 1024  # 10MB
     allowed_extensions: set = {".jpg", ".jpeg", ".png", ".webp"}
+    cors_origins: List[str] = [
+        "http://localhost:3000",  # React dev server
+        "http://127.0.0.1:3000",
+        "http://localhost:3001",
+        "http://127.0.0.1:3001",
+    ]
     
     # Model configurations
     image_model_name: str = "nlpconnect/vit-gpt2-image-captioning"
     recipe_model_name: str = "microsoft/DialoGPT-medium"
+    image_dtype: str = "auto"  # "auto" (FP16 on GPU, native otherwise) or a torch dtype name
+    image_quantize: str = "auto"  # "auto" (INT8 on CPU), "int8" (also 8-bit on GPU) or "none"
+    recipe_quantize: str = "auto"  # "auto" (INT8 on CPU, 4-bit on GPU) or "none"
     
     # Model settings
     use_gpu: bool = True  # Set to True if you have a GPU
     model_cache_dir: Optional[str] = None
+    compile_models: bool = True  # Use torch.compile where available (PyTorch 2.0+)
+    inference_threads: int = 2  # Worker threads for model inference
+    ai_recipes: bool = False  # Add language-model generated recipes (experimental)
+    
+    # Result caching
+    analysis_cache_size: int = 1024  # Cached image analyses (by upload hash)
+    analysis_cache_near_duplicates: bool = False  # Also match similar images by perceptual hash
+    recipe_cache_size: int = 1024  # Cached recipe lists (by ingredient set)
+    
+    @property
+    def server_workers(self) -> int:
+        """Number of server worker processes to run"""
+        return 1 if self.dev else self.workers
+    
+    @property
+    def worker_cpu_threads(self) -> int:
+        """CPU threads available to each server worker process"""
+        return max(1, (os.cpu_count() or 1) // self.server_workers)
     
     class Config:
         env_file = ".env"
 
-settings = Settings()
-
-# Ensure upload directory exists
-os.makedirs(settings.upload_dir, exist_ok=True) 
\ No newline at end of file
+settings = Settings() 
\ No newline at end of file
@@ -1,9 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import asyncio
 import logging
 
-from .api.routes import router
+import torch
+
+from .api.routes import router, preload_models
 from .core.config import settings
 
 # Set up logging
@@ -25,20 +28,13 @@ app = FastAPI(
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",  # React dev server
-        "http://127.0.0.1:3000",
-        "http://localhost:3001",
-        "http://127.0.0.1:3001",
-    ],
+    allow_origins=settings.cors_origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
+    max_age=86400,  # Let browsers cache preflight responses for a day
 )
 
-# Create upload directory
-os.makedirs(settings.upload_dir, exist_ok=True)
-
 # Include API routes
 app.include_router(router, prefix="/api/v1")
 
@@ -57,9 +53,18 @@ async def startup_event():
     """Startup event"""
     logger.info("🍳 RecipeSnap API is starting up...")
     logger.info(f"Upload directory: {settings.upload_dir}")
+    
+    # Create upload directory
+    os.makedirs(settings.upload_dir, exist_ok=True)
     logger.info(f"Debug mode: {settings.debug}")
     logger.info(f"Image model: {settings.image_model_name}")
     logger.info(f"Recipe model: {settings.recipe_model_name}")
+    
+    # Split the CPU between worker processes rather than oversubscribing it
+    torch.set_num_threads(settings.worker_cpu_threads)
+    
+    # Load models in the background so health checks are served meanwhile
+    app.state.model_loader = asyncio.create_task(preload_models())
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -72,6 +77,6 @@ if __name__ == "__main__":
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=settings.debug,
+        reload=settings.dev,
         log_level="info"
     ) 
\ No newline at end of file
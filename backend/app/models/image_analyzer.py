@@ -1,21 +1,113 @@
-from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
+from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer, BitsAndBytesConfig
 import torch
+import numpy as np
 from PIL import Image
+import io
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union, BinaryIO, Set, Tuple
 import re
+import threading
+from functools import lru_cache
 
 from ..core.config import settings
+from ..utils.batching import MicroBatcher
+from ..utils.image_processing import run_image_task
+from ..utils.model_loading import load_safetensors_model
+from ..utils.quantization import quantize_dynamic_int8
 
 logger = logging.getLogger(__name__)
 
+# Caption batching: concurrent requests are grouped into a single forward pass
+MAX_BATCH = 8  # Maximum images per batch
+WAIT_MS = 8    # How long to wait for a batch to fill up
+
+# Comprehensive list of common food ingredients
+FOOD_KEYWORDS = frozenset({
+    # Fruits
+    "apple", "apples", "banana", "bananas", "orange", "oranges", "lemon", "lemons",
+    "lime", "limes", "strawberry", "strawberries", "blueberry", "blueberries",
+    "grape", "grapes", "cherry", "cherries", "peach", "peaches", "pear", "pears",
+    "pineapple", "mango", "avocado", "avocados", "kiwi", "watermelon", "melon",
+    
+    # Vegetables
+    "tomato", "tomatoes", "potato", "potatoes", "onion", "onions", "carrot", "carrots",
+    "broccoli", "spinach", "lettuce", "cucumber", "cucumbers", "pepper", "peppers",
+    "bell pepper", "garlic", "ginger", "mushroom", "mushrooms", "corn", "peas",
+    "beans", "green beans", "celery", "cabbage", "cauliflower", "zucchini",
+    "eggplant", "radish", "beet", "beetroot", "asparagus", "artichoke",
+    
+    # Proteins
+    "chicken", "beef", "pork", "fish", "salmon", "tuna", "shrimp", "egg", "eggs",
+    "cheese", "milk", "yogurt", "tofu", "turkey", "ham", "bacon", "sausage",
+    
+    # Grains & Starches
+    "bread", "rice", "pasta", "noodles", "quinoa", "oats", "flour", "cereal",
+    "crackers", "tortilla", "bagel", "muffin",
+    
+    # Herbs & Spices
+    "basil", "oregano", "thyme", "rosemary", "parsley", "cilantro", "mint",
+    "sage", "dill", "chives", "paprika", "cumin", "turmeric", "cinnamon",
+    
+    # Pantry items
+    "oil", "olive oil", "butter", "salt", "pepper", "sugar", "honey", "vinegar",
+    "soy sauce", "mustard", "ketchup", "mayo", "mayonnaise",
+    
+    # Dairy
+    "milk", "cream", "yogurt", "cheese", "butter", "sour cream"
+})
+
+# Splits a caption into words
+_WORD_RE = re.compile(r"\b\w+\b")
+
+# Caption words hinting at a section of the fridge, and the items assumed to be there
+_DAIRY_TRIGGERS = frozenset({"milk", "dairy", "bottle", "bottles", "carton", "cartons"})
+_VEGETABLE_TRIGGERS = frozenset({"vegetable", "vegetables", "fresh", "green", "greens", "produce"})
+_FRUIT_TRIGGERS = frozenset({"fruit", "fruits", "orange", "oranges", "yellow"})
+
+_TRIGGER_CATEGORY = {
+    **dict.fromkeys(_DAIRY_TRIGGERS, "dairy"),
+    **dict.fromkeys(_VEGETABLE_TRIGGERS, "vegetables"),
+    **dict.fromkeys(_FRUIT_TRIGGERS, "fruits")
+}
+_CATEGORY_ITEMS = {
+    "dairy": ("Milk", "Eggs", "Cheese", "Butter"),
+    "vegetables": ("Tomatoes", "Lettuce", "Carrots", "Broccoli", "Onions"),
+    "fruits": ("Orange Juice", "Corn")
+}
+_DEFAULT_FRIDGE_ITEMS = (
+    "Milk", "Eggs", "Cheese", "Butter", "Orange Juice",
+    "Tomatoes", "Lettuce", "Carrots", "Broccoli", "Corn",
+    "Onions", "Bell Peppers", "Herbs", "Cucumber"
+)
+
+# Food-related words used when no specific ingredient is found
+_FALLBACK_TOKENS = frozenset({
+    "food", "foods", "fruit", "fruits", "vegetable", "vegetables",
+    "meat", "meats", "dairy", "fresh", "organic"
+})
+
+# Detections too vague to be useful on their own
+_GENERIC_TERMS = frozenset({"fresh", "fruits", "vegetables", "food", "items", "produce"})
+
+# Caption used when captioning fails
+_FALLBACK_CAPTION = "fresh ingredients and food items"
+
 class ImageAnalyzer:
     def __init__(self):
         self.model = None
         self.feature_extractor = None
         self.tokenizer = None
         self.device = None
+        self.pad_token_id = None
+        self._batcher = MicroBatcher(self._generate_captions, MAX_BATCH, WAIT_MS)
+        self._pinned = None
+        self._device_buffer = None
+        self._copy_stream = None
+        self._eager_encoder_forward = None
         self._initialize_model()
+        
+        # The fallback caption always yields the same ingredients
+        self._fallback_ingredients = tuple(self._ingredients_from_caption(_FALLBACK_CAPTION))
     
     def _initialize_model(self):
         """Initialize the image captioning model"""
@@ -26,10 +118,29 @@ class ImageAnalyzer:
             self.device = torch.device("cuda" if torch.cuda.is_available() and settings.use_gpu else "cpu")
             logger.info(f"Using device: {self.device}")
             
+            # Load weights straight into their target dtype and device to avoid
+            # materializing an FP32 copy on the CPU first
+            if settings.image_dtype != "auto":
+                torch_dtype = getattr(torch, settings.image_dtype)
+            elif self.device.type == "cuda":
+                torch_dtype = torch.float16
+            else:
+                torch_dtype = "auto"
+            
+            # 8-bit weights on GPU are opt-in (bitsandbytes); CPU quantization happens after loading
+            quantization_config = None
+            if settings.image_quantize == "int8" and self.device.type == "cuda":
+                quantization_config = BitsAndBytesConfig(load_in_8bit=True)
+            
             # Load model components
-            self.model = VisionEncoderDecoderModel.from_pretrained(
+            self.model = load_safetensors_model(
+                VisionEncoderDecoderModel,
                 settings.image_model_name,
-                cache_dir=settings.model_cache_dir
+                cache_dir=settings.model_cache_dir,
+                torch_dtype=torch_dtype,
+                low_cpu_mem_usage=True,
+                device_map={"": self.device},
+                quantization_config=quantization_config
             )
             self.feature_extractor = ViTImageProcessor.from_pretrained(
                 settings.image_model_name,
@@ -39,46 +150,92 @@ class ImageAnalyzer:
                 settings.image_model_name,
                 cache_dir=settings.model_cache_dir
             )
+            self.pad_token_id = self.tokenizer.eos_token_id
             
-            # Move model to device
-            self.model.to(self.device)
             self.model.eval()  # Set to evaluation mode
             
+            # INT8 dynamic quantization of the ViT encoder and of the GPT-2
+            # decoder blocks (whose Conv1D layers are converted to Linear first)
+            # on (bandwidth-bound) CPU inference
+            quantized = quantization_config is not None
+            if (settings.image_quantize in ("auto", "int8") and self.device.type == "cpu"
+                    and self.model.dtype == torch.float32):
+                self.model = quantize_dynamic_int8(self.model)
+                quantized = True
+            
+            # Compile the ViT encoder to fuse its kernels; the decoder changes
+            # shape at every generation step so it stays eager. Quantized
+            # modules can't be traced, so they are left as is.
+            if settings.compile_models and not quantized and hasattr(torch, "compile"):
+                self._compile_encoder()
+            
+            # Preallocate pinned host and device buffers for a full batch so
+            # requests don't pay for fresh allocations and pageable copies
+            if self.device.type == "cuda":
+                size = self.feature_extractor.size
+                shape = (MAX_BATCH, 3, size["height"], size["width"])
+                self._pinned = torch.empty(shape, pin_memory=True)
+                self._device_buffer = torch.empty(shape, dtype=self.model.dtype, device=self.device)
+                self._copy_stream = torch.cuda.Stream(device=self.device)
+            
             logger.info("Image analysis model loaded successfully!")
             
         except Exception as e:
             logger.error(f"Error loading image analysis model: {e}")
             raise
     
-    def analyze_image(self, image_path: str) -> Dict[str, any]:
-        """Analyze image and extract ingredients information"""
+    def _compile_encoder(self):
+        """Compile the encoder and warm it up for every batch size
+        
+        Compilation happens here, while the model is still reported as
+        loading, instead of on the first caption requests. CUDA graphs are
+        left out: their state is per thread, and captions are generated on
+        the inference pool rather than on the loading thread.
+        """
+        eager_forward = self.model.encoder.forward
         try:
-            # Load and preprocess image
-            image = Image.open(image_path)
-            if image.mode != "RGB":
-                image = image.convert("RGB")
+            self.model.encoder.forward = torch.compile(
+                eager_forward,
+                mode="max-autotune-no-cudagraphs",
+                fullgraph=False
+            )
+            
+            size = self.feature_extractor.size
+            with torch.inference_mode():
+                for batch_size in range(1, MAX_BATCH + 1):
+                    pixel_values = torch.zeros(
+                        (batch_size, 3, size["height"], size["width"]),
+                        dtype=self.model.dtype,
+                        device=self.device
+                    )
+                    self.model.encoder(pixel_values=pixel_values)
+            self._eager_encoder_forward = eager_forward
+            logger.info("Image encoder compiled")
+        except Exception as e:
+            logger.warning(f"Could not compile image encoder: {e}")
+            self.model.encoder.forward = eager_forward
+    
+    async def analyze_image(self, image_source: Union[str, bytes, memoryview, BinaryIO, np.ndarray]) -> Dict[str, any]:
+        """Analyze image and extract ingredients information
+        
+        Accepts a file path, raw image bytes (or a memoryview over them), a
+        binary file object or an already decoded RGB (HWC) array.
+        """
+        try:
+            # Decode and preprocess off the event loop
+            pixel_values = await run_image_task(self._preprocess, image_source)
             
-            # Generate caption
-            caption = self._generate_caption(image)
+            # Generate caption (batched with other concurrent requests)
+            caption = await self._batcher.submit(pixel_values)
             logger.info(f"Generated caption: {caption}")
             
             # Extract potential ingredients from caption
-            ingredients = self._extract_ingredients(caption)
-            logger.info(f"Extracted ingredients: {ingredients}")
-            
-            # Check if we got generic/poor results and use improved analysis
-            generic_terms = ['fresh', 'fruits', 'vegetables', 'food', 'items', 'produce']
-            if (len(ingredients) == 0 or 
-                len(ingredients) <= 3 and all(ing.lower() in generic_terms for ing in ingredients)):
-                
-                # Use fridge-specific analysis
-                fridge_ingredients = self._analyze_fridge_contents(caption)
-                if fridge_ingredients:
-                    ingredients = fridge_ingredients
-                    logger.info(f"Using fridge content analysis: {ingredients}")
-                else:
-                    ingredients = self._get_common_fridge_ingredients()
-                    logger.info(f"Using common fridge ingredients as fallback: {ingredients}")
+            fallback = caption is None
+            if fallback:
+                caption = _FALLBACK_CAPTION
+                ingredients = list(self._fallback_ingredients)
+            else:
+                ingredients = self._ingredients_from_caption(caption)
             
             # Calculate confidence based on number of ingredients found
             confidence = min(0.9, 0.6 + (len(ingredients) * 0.02))
@@ -87,7 +244,8 @@ class ImageAnalyzer:
                 "success": True,
                 "caption": caption,
                 "ingredients": ingredients,
-                "confidence": confidence
+                "confidence": confidence,
+                "fallback": fallback
             }
         except Exception as e:
             logger.error(f"Error analyzing image: {e}")
@@ -98,33 +256,71 @@ class ImageAnalyzer:
                 "ingredients": []
             }
     
-    def _generate_caption(self, image: Image.Image) -> str:
-        """Generate caption for the image"""
+    def _preprocess(self, image_source: Union[str, bytes, memoryview, BinaryIO, np.ndarray]) -> torch.Tensor:
+        """Load an image and convert it to model pixel values"""
+        # Decoded arrays go straight to the feature extractor
+        if isinstance(image_source, np.ndarray):
+            image = image_source
+        else:
+            if isinstance(image_source, (bytes, bytearray, memoryview)):
+                image_source = io.BytesIO(image_source)
+            image = Image.open(image_source)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+        
+        return self.feature_extractor(
+            images=[image], 
+            return_tensors="pt"
+        ).pixel_values
+    
+    def _generate_captions(self, images: List[torch.Tensor]) -> List[Optional[str]]:
+        """Generate captions for a batch of preprocessed images (None where captioning failed)"""
         try:
-            # Preprocess image
-            pixel_values = self.feature_extractor(
-                images=[image], 
-                return_tensors="pt"
-            ).pixel_values
-            pixel_values = pixel_values.to(self.device)
-            
-            # Generate caption with simpler parameters to avoid beam search issues
-            with torch.no_grad():
-                output_ids = self.model.generate(
-                    pixel_values, 
-                    max_length=20,
-                    do_sample=True,
-                    temperature=0.7,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    num_return_sequences=1
-                )
-            
-            caption = self.tokenizer.decode(output_ids[0], skip_special_tokens=True)
-            return caption.strip()
+            return self._caption_batch(images)
+        except Exception as e:
+            if self._eager_encoder_forward is None:
+                logger.error(f"Error generating caption: {e}")
+                return [None] * len(images)
             
+            # The compiled encoder failed at runtime; go back to the eager one
+            logger.warning(f"Compiled image encoder failed, switching to eager mode: {e}")
+            self.model.encoder.forward = self._eager_encoder_forward
+            self._eager_encoder_forward = None
+        
+        try:
+            return self._caption_batch(images)
         except Exception as e:
             logger.error(f"Error generating caption: {e}")
-            return "fresh ingredients and food items"
+            return [None] * len(images)
+    
+    def _caption_batch(self, images: List[torch.Tensor]) -> List[str]:
+        """Run the captioning model on a batch of preprocessed images"""
+        batch_size = len(images)
+        if self._pinned is not None:
+            # Stage the batch in the pinned buffer and copy it to the
+            # preallocated device buffer on a separate stream
+            for i, image_values in enumerate(images):
+                self._pinned[i].copy_(image_values[0])
+            pixel_values = self._device_buffer[:batch_size]
+            with torch.cuda.stream(self._copy_stream):
+                pixel_values.copy_(self._pinned[:batch_size], non_blocking=True)
+            torch.cuda.current_stream(self.device).wait_stream(self._copy_stream)
+        else:
+            pixel_values = torch.cat(images, dim=0).to(self.device, dtype=self.model.dtype)
+        
+        # Greedy decoding with the KV cache (deterministic and cheaper than sampling)
+        with torch.inference_mode():
+            output_ids = self.model.generate(
+                pixel_values, 
+                max_new_tokens=16,
+                num_beams=1,
+                do_sample=False,
+                use_cache=True,
+                pad_token_id=self.pad_token_id
+            )
+        
+        captions = self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+        return [caption.strip() for caption in captions]
     
     def _get_common_fridge_ingredients(self) -> List[str]:
         """Return common fridge ingredients when detection fails"""
@@ -135,106 +331,90 @@ class ImageAnalyzer:
             "Corn", "Cabbage", "Bell Peppers", "Cucumber", "Herbs"
         ]
     
-    def _analyze_fridge_contents(self, caption: str) -> List[str]:
-        """Analyze fridge contents based on common patterns"""
-        detected_items = []
+    def _ingredients_from_caption(self, caption: str) -> List[str]:
+        """Turn a caption into a list of ingredients"""
+        tokens = _WORD_RE.findall(caption.lower())
+        ingredients, categories = self._scan_tokens(tokens)
+        logger.info(f"Extracted ingredients: {ingredients}")
         
-        # Common fridge items by category
-        dairy_items = ["milk", "cheese", "butter", "yogurt", "cream", "eggs"]
-        vegetables = ["tomatoes", "lettuce", "carrots", "broccoli", "corn", "onions", 
-                     "peppers", "cucumber", "cabbage", "herbs", "parsley"]
-        fruits = ["oranges", "apples", "lemons", "pineapple"]
-        beverages = ["juice", "orange juice", "milk"]
+        # Check if we got generic/poor results and use improved analysis
+        if not ingredients or (len(ingredients) <= 3 and _GENERIC_TERMS.issuperset(ingredients)):
+            # Use fridge-specific analysis
+            fridge_ingredients = self._analyze_fridge_contents(categories)
+            if fridge_ingredients:
+                logger.info(f"Using fridge content analysis: {fridge_ingredients}")
+                return fridge_ingredients
+            
+            ingredients = self._get_common_fridge_ingredients()
+            logger.info(f"Using common fridge ingredients as fallback: {ingredients}")
+            return ingredients
         
-        caption_lower = caption.lower()
+        return [ingredient.title() for ingredient in ingredients]
+    
+    def _scan_tokens(self, tokens: List[str]) -> Tuple[List[str], Set[str]]:
+        """Find ingredients and fridge-section hints in a single pass over the caption words
+        
+        Returns the (lowercase) ingredients in caption order and the set of
+        fridge sections hinted at.
+        """
+        found_ingredients = {}
+        food_related_words = {}
+        categories = set()
         
-        # Check for dairy section indicators
-        if any(word in caption_lower for word in ["milk", "dairy", "bottles", "carton"]):
-            detected_items.extend(["Milk", "Eggs", "Cheese", "Butter"])
+        skip_next = False
+        for i, token in enumerate(tokens):
+            category = _TRIGGER_CATEGORY.get(token)
+            if category is not None:
+                categories.add(category)
+            
+            # Second word of an already matched two-word keyword
+            if skip_next:
+                skip_next = False
+                continue
+            
+            # Prefer two-word keywords ("bell pepper") over their last word
+            pair = f"{token} {tokens[i + 1]}" if i + 1 < len(tokens) else None
+            if pair in FOOD_KEYWORDS:
+                found_ingredients[pair] = None
+                skip_next = True
+            elif token in FOOD_KEYWORDS:
+                found_ingredients[token] = None
+            elif token in _FALLBACK_TOKENS:
+                food_related_words[token] = None
         
-        # Check for vegetable section indicators  
-        if any(word in caption_lower for word in ["vegetables", "fresh", "green", "produce"]):
-            detected_items.extend(["Tomatoes", "Lettuce", "Carrots", "Broccoli", "Onions"])
+        # If no specific ingredients found, fall back to words that might be food
+        if not found_ingredients:
+            return list(food_related_words)[:3], categories  # Limit to 3
         
-        # Check for fruit indicators
-        if any(word in caption_lower for word in ["fruit", "orange", "yellow"]):
-            detected_items.extend(["Orange Juice", "Corn"])
+        return list(found_ingredients)[:10], categories  # Limit to 10 ingredients max
+    
+    def _analyze_fridge_contents(self, categories: Set[str]) -> List[str]:
+        """Analyze fridge contents based on the sections hinted at by the caption"""
+        # Add the typical items of every hinted fridge section
+        detected_items = {}
+        for category, items in _CATEGORY_ITEMS.items():
+            if category in categories:
+                detected_items.update(dict.fromkeys(items))
         
         # If nothing specific detected, return a good variety
         if not detected_items:
-            detected_items = [
-                "Milk", "Eggs", "Cheese", "Butter", "Orange Juice",
-                "Tomatoes", "Lettuce", "Carrots", "Broccoli", "Corn",
-                "Onions", "Bell Peppers", "Herbs", "Cucumber"
-            ]
-        
-        return list(set(detected_items))  # Remove duplicates
-    
-    def _extract_ingredients(self, caption: str) -> List[str]:
-        """Extract potential ingredients from caption"""
-        # Comprehensive list of common food ingredients
-        food_keywords = {
-            # Fruits
-            "apple", "apples", "banana", "bananas", "orange", "oranges", "lemon", "lemons",
-            "lime", "limes", "strawberry", "strawberries", "blueberry", "blueberries",
-            "grape", "grapes", "cherry", "cherries", "peach", "peaches", "pear", "pears",
-            "pineapple", "mango", "avocado", "avocados", "kiwi", "watermelon", "melon",
-            
-            # Vegetables
-            "tomato", "tomatoes", "potato", "potatoes", "onion", "onions", "carrot", "carrots",
-            "broccoli", "spinach", "lettuce", "cucumber", "cucumbers", "pepper", "peppers",
-            "bell pepper", "garlic", "ginger", "mushroom", "mushrooms", "corn", "peas",
-            "beans", "green beans", "celery", "cabbage", "cauliflower", "zucchini",
-            "eggplant", "radish", "beet", "beetroot", "asparagus", "artichoke",
-            
-            # Proteins
-            "chicken", "beef", "pork", "fish", "salmon", "tuna", "shrimp", "egg", "eggs",
-            "cheese", "milk", "yogurt", "tofu", "turkey", "ham", "bacon", "sausage",
-            
-            # Grains & Starches
-            "bread", "rice", "pasta", "noodles", "quinoa", "oats", "flour", "cereal",
-            "crackers", "tortilla", "bagel", "muffin",
-            
-            # Herbs & Spices
-            "basil", "oregano", "thyme", "rosemary", "parsley", "cilantro", "mint",
-            "sage", "dill", "chives", "paprika", "cumin", "turmeric", "cinnamon",
-            
-            # Pantry items
-            "oil", "olive oil", "butter", "salt", "pepper", "sugar", "honey", "vinegar",
-            "soy sauce", "mustard", "ketchup", "mayo", "mayonnaise",
-            
-            # Dairy
-            "milk", "cream", "yogurt", "cheese", "butter", "sour cream"
-        }
+            return list(_DEFAULT_FRIDGE_ITEMS)
         
-        caption_lower = caption.lower()
-        found_ingredients = []
-        
-        # Look for exact matches and partial matches
-        for ingredient in food_keywords:
-            if ingredient in caption_lower:
-                # Capitalize first letter for display
-                display_name = ingredient.replace("_", " ").title()
-                if display_name not in found_ingredients:
-                    found_ingredients.append(display_name)
-        
-        # If no specific ingredients found, try to extract nouns that might be food
-        if not found_ingredients:
-            # Simple noun extraction for food-related words
-            words = re.findall(r'\b\w+\b', caption_lower)
-            food_related_words = []
-            
-            for word in words:
-                if any(food_word in word for food_word in ["food", "fruit", "vegetable", "meat", "dairy", "fresh", "organic"]):
-                    food_related_words.append(word.title())
-            
-            if food_related_words:
-                found_ingredients.extend(food_related_words[:3])  # Limit to 3
-        
-        # Remove duplicates while preserving order
-        unique_ingredients = []
-        for ingredient in found_ingredients:
-            if ingredient not in unique_ingredients:
-                unique_ingredients.append(ingredient)
-        
-        return unique_ingredients[:10]  # Limit to 10 ingredients max 
\ No newline at end of file
+        return list(detected_items)
+
+_image_analyzer_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _build_image_analyzer() -> ImageAnalyzer:
+    logger.info("Initializing image analyzer...")
+    return ImageAnalyzer()
+
+def get_image_analyzer() -> ImageAnalyzer:
+    """Return the process-wide image analyzer, loading the model on first use"""
+    # The lock keeps concurrent first requests from loading the model twice
+    with _image_analyzer_lock:
+        return _build_image_analyzer()
+
+def image_analyzer_loaded() -> bool:
+    """Whether the image analyzer has been created in this process"""
+    return _build_image_analyzer.cache_info().currsize > 0
@@ -1,22 +1,276 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 import torch
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from functools import lru_cache
 import logging
 import random
+import heapq
+import threading
+import orjson
+import ahocorasick
 
 from ..core.config import settings
+from ..utils.batching import MicroBatcher
+from ..utils.cache import LRUCache
+from ..utils.model_loading import load_safetensors_model
+from ..utils.quantization import quantize_dynamic_int8
 
 logger = logging.getLogger(__name__)
 
+# Curated recipe database
+_RECIPES_DB = (
+    {
+        "id": 1,
+        "title": "Fresh Garden Salad",
+        "description": "A healthy and refreshing salad with fresh vegetables",
+        "ingredients": ["Lettuce", "Tomato", "Cucumber", "Onion", "Olive Oil", "Lemon"],
+        "instructions": [
+            "Wash and chop all vegetables into bite-sized pieces",
+            "Place lettuce in a large salad bowl as the base",
+            "Add tomatoes, cucumber, and onion on top",
+            "Drizzle with olive oil and fresh lemon juice",
+            "Season with salt and pepper to taste",
+            "Toss gently and serve immediately"
+        ],
+        "prep_time": "15 minutes",
+        "cook_time": "0 minutes",
+        "servings": 4,
+        "difficulty": "Easy",
+        "cuisine": "Mediterranean",
+        "source": "Curated"
+    },
+    {
+        "id": 2,
+        "title": "Vegetable Stir Fry",
+        "description": "Quick and healthy stir-fried vegetables",
+        "ingredients": ["Broccoli", "Carrot", "Bell Pepper", "Garlic", "Ginger", "Soy Sauce", "Oil"],
+        "instructions": [
+            "Heat 2 tablespoons of oil in a large pan or wok over high heat",
+            "Add minced garlic and ginger, stir-fry for 30 seconds until fragrant",
+            "Add harder vegetables first (carrots, broccoli) and cook for 3-4 minutes",
+            "Add softer vegetables (bell peppers) and cook for another 2 minutes",
+            "Add soy sauce and stir everything together",
+            "Cook for 1-2 more minutes until vegetables are tender-crisp",
+            "Serve hot over rice or noodles"
+        ],
+        "prep_time": "10 minutes",
+        "cook_time": "10 minutes",
+        "servings": 3,
+        "difficulty": "Easy",
+        "cuisine": "Asian",
+        "source": "Curated"
+    },
+    {
+        "id": 3,
+        "title": "Fruit Smoothie Bowl",
+        "description": "Nutritious and delicious smoothie bowl",
+        "ingredients": ["Banana", "Strawberry", "Blueberry", "Milk", "Honey", "Granola"],
+        "instructions": [
+            "Freeze fruits for at least 2 hours before making",
+            "Add frozen banana and berries to a blender",
+            "Pour in a small amount of milk and blend until smooth and thick",
+            "Pour the smoothie into a bowl",
+            "Top with fresh fruits, granola, and a drizzle of honey",
+            "Add nuts or seeds if available",
+            "Serve immediately with a spoon"
+        ],
+        "prep_time": "5 minutes",
+        "cook_time": "0 minutes",
+        "servings": 1,
+        "difficulty": "Easy",
+        "cuisine": "Healthy",
+        "source": "Curated"
+    },
+    {
+        "id": 4,
+        "title": "Scrambled Eggs with Vegetables",
+        "description": "Protein-rich breakfast with fresh vegetables",
+        "ingredients": ["Eggs", "Tomato", "Onion", "Pepper", "Cheese", "Butter", "Salt"],
+        "instructions": [
+            "Crack 3-4 eggs into a bowl and whisk with salt and pepper",
+            "Dice tomatoes, onions, and peppers into small pieces",
+            "Heat butter in a non-stick pan over medium heat",
+            "Add vegetables and cook for 3-4 minutes until softened",
+            "Pour in the beaten eggs and let sit for 30 seconds",
+            "Gently stir and scramble the eggs with the vegetables",
+            "Add cheese in the last minute and fold in gently",
+            "Serve hot with toast or bread"
+        ],
+        "prep_time": "8 minutes",
+        "cook_time": "7 minutes",
+        "servings": 2,
+        "difficulty": "Easy",
+        "cuisine": "American",
+        "source": "Curated"
+    },
+    {
+        "id": 5,
+        "title": "Roasted Vegetable Medley",
+        "description": "Colorful roasted vegetables with herbs",
+        "ingredients": ["Broccoli", "Bell Peppers", "Carrots", "Onions", "Olive Oil", "Herbs", "Salt"],
+        "instructions": [
+            "Preheat oven to 425°F (220°C)",
+            "Cut all vegetables into similar-sized pieces",
+            "Toss vegetables with olive oil, salt, and herbs",
+            "Spread on a large baking sheet in a single layer",
+            "Roast for 25-30 minutes, stirring once halfway through",
+            "Vegetables should be tender and lightly caramelized",
+            "Serve as a side dish or over rice"
+        ],
+        "prep_time": "15 minutes",
+        "cook_time": "30 minutes",
+        "servings": 4,
+        "difficulty": "Easy",
+        "cuisine": "Mediterranean",
+        "source": "Curated"
+    },
+    {
+        "id": 6,
+        "title": "Fresh Vegetable Omelet",
+        "description": "Fluffy omelet packed with fresh vegetables",
+        "ingredients": ["Eggs", "Milk", "Cheese", "Tomatoes", "Onions", "Bell Peppers", "Herbs"],
+        "instructions": [
+            "Beat 3 eggs with 2 tablespoons of milk",
+            "Dice vegetables into small pieces",
+            "Heat a non-stick pan over medium heat with a little oil",
+            "Sauté vegetables for 2-3 minutes until softened",
+            "Pour in the beaten eggs and let set for 1 minute",
+            "Add cheese and herbs to one half of the omelet",
+            "Fold the omelet in half and slide onto a plate",
+            "Serve immediately while hot"
+        ],
+        "prep_time": "10 minutes",
+        "cook_time": "8 minutes",
+        "servings": 1,
+        "difficulty": "Medium",
+        "cuisine": "French",
+        "source": "Curated"
+    },
+    {
+        "id": 7,
+        "title": "Corn and Vegetable Soup",
+        "description": "Hearty soup with fresh corn and vegetables",
+        "ingredients": ["Corn", "Carrots", "Onions", "Broccoli", "Vegetable Broth", "Herbs", "Salt"],
+        "instructions": [
+            "Heat oil in a large pot over medium heat",
+            "Add diced onions and carrots, cook for 5 minutes",
+            "Add corn kernels and cook for 3 minutes",
+            "Pour in vegetable broth and bring to a boil",
+            "Add broccoli and herbs, simmer for 10 minutes",
+            "Season with salt and pepper to taste",
+            "Serve hot with crusty bread"
+        ],
+        "prep_time": "15 minutes",
+        "cook_time": "20 minutes",
+        "servings": 4,
+        "difficulty": "Easy",
+        "cuisine": "American",
+        "source": "Curated"
+    },
+    {
+        "id": 8,
+        "title": "Cheese and Herb Frittata",
+        "description": "Baked egg dish with cheese and fresh herbs",
+        "ingredients": ["Eggs", "Milk", "Cheese", "Herbs", "Onions", "Butter", "Salt"],
+        "instructions": [
+            "Preheat oven to 375°F (190°C)",
+            "Beat 6 eggs with milk, salt, and pepper",
+            "Heat butter in an oven-safe skillet over medium heat",
+            "Add diced onions and cook until softened",
+            "Pour in the egg mixture and add cheese and herbs",
+            "Cook for 3-4 minutes until edges start to set",
+            "Transfer to oven and bake for 12-15 minutes",
+            "Cut into wedges and serve warm"
+        ],
+        "prep_time": "10 minutes",
+        "cook_time": "20 minutes",
+        "servings": 4,
+        "difficulty": "Medium",
+        "cuisine": "Italian",
+        "source": "Curated"
+    }
+)
+
+# Lowercased ingredient set of each curated recipe, for fast matching
+_RECIPE_TOKENS = [frozenset(ing.lower() for ing in recipe["ingredients"]) for recipe in _RECIPES_DB]
+_RECIPE_VOCABULARY = frozenset().union(*_RECIPE_TOKENS)
+
+# Each curated ingredient gets one bit, so a recipe's ingredients (and the
+# curated ingredients a user has) are a single int bitmask
+_TOKEN_ID = {token: bit for bit, token in enumerate(sorted(_RECIPE_VOCABULARY))}
+_RECIPE_MASKS = [sum(1 << _TOKEN_ID[token] for token in tokens) for tokens in _RECIPE_TOKENS]
+_RECIPE_POPCOUNT = [mask.bit_count() for mask in _RECIPE_MASKS]
+
+# Aho-Corasick automaton over the curated ingredients, finding every curated
+# ingredient contained in a user ingredient in a single pass
+_VOCABULARY_AUTOMATON = ahocorasick.Automaton()
+for _token in _RECIPE_VOCABULARY:
+    _VOCABULARY_AUTOMATON.add_word(_token, 1 << _TOKEN_ID[_token])
+_VOCABULARY_AUTOMATON.make_automaton()
+
+@lru_cache(maxsize=1024)
+def _matching_mask(ingredient: str) -> int:
+    """Bitmask of curated ingredients that contain, or are contained in, a lowercased user ingredient"""
+    mask = 0
+    for _, bit in _VOCABULARY_AUTOMATON.iter(ingredient):
+        mask |= bit
+    for token, token_id in _TOKEN_ID.items():
+        if ingredient in token:
+            mask |= 1 << token_id
+    return mask
+
+MAX_PROMPT_TOKENS = 100
+
+# Greedy decoding with the KV cache; sampling and n-gram blocking add
+# per-token Python work to every generation step
+GENERATION_KWARGS = {
+    "max_new_tokens": 150,
+    "use_cache": True,
+    "do_sample": False,
+    "num_beams": 1,
+}
+
+MAX_BATCH = 8  # Maximum prompts per generation batch
+WAIT_MS = 10   # How long to wait for a batch to fill up
+
+# Pre-encoded JSON of each curated recipe, without the closing brace so the
+# per-request match fields can be appended
+_RECIPE_JSON_FRAGMENTS = {recipe["id"]: orjson.dumps(recipe)[:-1] for recipe in _RECIPES_DB}
+
 class RecipeGenerator:
     def __init__(self):
         self.model = None
         self.tokenizer = None
         self.device = None
-        self._initialize_model()
+        self._cache = LRUCache(settings.recipe_cache_size)
+        self._json_cache = LRUCache(settings.recipe_cache_size)
+        self._batcher = MicroBatcher(self._generate_ai_texts, MAX_BATCH, WAIT_MS)
+        self._prompt_prefix_ids = None
+        self._comma_ids = None
+        self._colon_ids = None
+        self._ingredient_ids = lru_cache(maxsize=512)(self._encode_ingredient)
+        self._model_lock = threading.Lock()
+        self.model_loaded = False
+    
+    def load_model(self):
+        """Load the generation model (once); curated recipes are served without it"""
+        with self._model_lock:
+            if not self.model_loaded:
+                self._initialize_model()
+                self.model_loaded = True
+    
+    def _ai_available(self) -> bool:
+        """Whether AI recipes can be generated right now"""
+        return settings.ai_recipes and self.model_loaded and self.model is not None
     
     def _initialize_model(self):
         """Initialize the recipe generation model"""
+        # The language model is only used for AI recipes; curated recipes
+        # don't need it, so don't spend the memory when they're disabled
+        if not settings.ai_recipes:
+            logger.info("AI recipes are disabled, skipping the recipe generation model")
+            return
+        
         try:
             logger.info("Loading recipe generation model...")
             
@@ -29,19 +283,61 @@ class RecipeGenerator:
                 settings.recipe_model_name,
                 cache_dir=settings.model_cache_dir
             )
-            self.model = AutoModelForCausalLM.from_pretrained(
-                settings.recipe_model_name,
-                cache_dir=settings.model_cache_dir
-            )
+            
+            # 4-bit weights on GPU (bitsandbytes) are loaded straight onto the device
+            quantize = settings.recipe_quantize == "auto"
+            load_kwargs = {"torch_dtype": torch.float16 if self.device.type == "cuda" else torch.float32}
+            if quantize and self.device.type == "cuda":
+                load_kwargs["quantization_config"] = BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_compute_dtype=torch.float16
+                )
+                load_kwargs["device_map"] = {"": self.device}
+            
+            # Use fused attention kernels (FlashAttention on GPU when flash-attn
+            # is installed, PyTorch SDPA otherwise) and only fall back to eager
+            # attention if neither loads
+            attn_implementations = ["flash_attention_2", "sdpa"] if self.device.type == "cuda" else ["sdpa"]
+            for attn_implementation in attn_implementations + [None]:
+                if attn_implementation:
+                    load_kwargs["attn_implementation"] = attn_implementation
+                else:
+                    load_kwargs.pop("attn_implementation", None)
+                try:
+                    self.model = load_safetensors_model(
+                        AutoModelForCausalLM,
+                        settings.recipe_model_name,
+                        cache_dir=settings.model_cache_dir,
+                        **load_kwargs
+                    )
+                    break
+                except (ImportError, ValueError) as e:
+                    if attn_implementation is None:
+                        raise
+                    logger.info(f"{attn_implementation} attention unavailable: {e}")
+            if attn_implementation is None:
+                logger.warning("Fused attention unavailable, recipe model is using eager attention")
+            else:
+                logger.info(f"Recipe model attention: {attn_implementation}")
             
             # Set pad token if not exists
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
             
+            # Pre-tokenize the fixed pieces of the "Recipe with a, b:" prompt
+            self._prompt_prefix_ids = self._token_ids("Recipe with")
+            self._comma_ids = self._token_ids(",")
+            self._colon_ids = self._token_ids(":")
+            
             # Move model to device
-            self.model.to(self.device)
+            if "device_map" not in load_kwargs:
+                self.model.to(self.device)
             self.model.eval()
             
+            # INT8 dynamic quantization of the attention/MLP layers on CPU
+            if quantize and self.device.type == "cpu":
+                self.model = quantize_dynamic_int8(self.model)
+            
             logger.info("Recipe generation model loaded successfully!")
             
         except Exception as e:
@@ -56,273 +352,228 @@ class RecipeGenerator:
             if not ingredients:
                 return self._get_fallback_recipes()
             
+            # Matching is case-insensitive, so the ingredient set is the cache key
+            cache_key = tuple(sorted({ing.lower() for ing in ingredients}))
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
             logger.info(f"Generating recipes for ingredients: {ingredients}")
             
             # Get curated recipes (always available and reliable)
             curated_recipes = self._get_curated_recipes(ingredients)
             
-            # Skip AI recipe generation for now as it's producing poor results
-            # Focus on curated recipes which are much more reliable
+            # AI recipe generation is off by default as it tends to produce poor
+            # results; curated recipes are much more reliable
             ai_recipes = []
+            if self._ai_available():
+                ai_recipe = self._generate_ai_recipe(ingredients)
+                if ai_recipe:
+                    ai_recipes.append(ai_recipe)
             
             # Combine results (prioritize curated recipes)
             all_recipes = curated_recipes + ai_recipes
             
-            # Return top 3 recipes
-            return all_recipes[:3]
+            # Return top 3 recipes (curated-only results served while the
+            # model is still loading aren't cached)
+            recipes = all_recipes[:3]
+            if not settings.ai_recipes or self.model_loaded:
+                self._cache.put(cache_key, recipes)
+            return recipes
             
         except Exception as e:
             logger.error(f"Error generating recipes: {e}")
             return self._get_fallback_recipes()
     
-    def _generate_ai_recipe(self, ingredients: List[str]) -> Dict[str, any]:
-        """Generate a recipe using the AI model"""
+    def generate_recipes_raw(self, ingredients: List[str]) -> bytes:
+        """Generate recipes as a ready-to-send JSON response body
+        
+        Returns the same recipes as generate_recipes, assembled from
+        pre-encoded recipe fragments so no dicts are built or serialized.
+        """
         try:
-            # Create prompt
-            ingredients_str = ", ".join(ingredients[:5])  # Limit to 5 ingredients
-            prompt = f"Recipe with {ingredients_str}:"
+            if settings.ai_recipes:
+                # AI recipes aren't pre-encoded, take the regular path
+                recipes = self.generate_recipes(ingredients)
+                return orjson.dumps({"success": True, "recipes": recipes, "total": len(recipes)})
             
-            # Tokenize
-            inputs = self.tokenizer.encode(
-                prompt, 
-                return_tensors="pt", 
-                max_length=100, 
-                truncation=True
+            if not ingredients:
+                recipes_json = [orjson.dumps(recipe) for recipe in self._get_fallback_recipes()]
+            else:
+                cache_key = tuple(sorted({ing.lower() for ing in ingredients}))
+                cached = self._json_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+                
+                logger.info(f"Generating recipes for ingredients: {ingredients}")
+                
+                # Only curated recipes are served when AI generation is disabled
+                recipes_json = self._get_curated_recipes_json(ingredients)[:3]
+            
+            body = (
+                b'{"success":true,"recipes":[' + b",".join(recipes_json)
+                + b'],"total":' + str(len(recipes_json)).encode() + b"}"
             )
-            inputs = inputs.to(self.device)
+            if ingredients:
+                self._json_cache.put(cache_key, body)
+            return body
             
-            # Generate
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs,
-                    max_length=inputs.shape[1] + 150,
-                    num_return_sequences=1,
-                    temperature=0.8,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    no_repeat_ngram_size=2
-                )
+        except Exception as e:
+            logger.error(f"Error generating recipes: {e}")
+            recipes = self._get_fallback_recipes()
+            return orjson.dumps({"success": True, "recipes": recipes, "total": len(recipes)})
+    
+    async def generate_recipes_async(self, ingredients: List[str]) -> List[Dict[str, any]]:
+        """Generate recipes, batching AI generation with other concurrent requests"""
+        if not self._ai_available() or not ingredients:
+            return self.generate_recipes(ingredients)
+        
+        try:
+            cache_key = tuple(sorted({ing.lower() for ing in ingredients}))
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
             
-            # Decode
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            recipe_text = generated_text[len(prompt):].strip()
+            logger.info(f"Generating recipes for ingredients: {ingredients}")
             
-            # Create structured recipe
-            return {
-                "id": 999,
-                "title": f"AI Recipe with {ingredients[0]}",
-                "description": "An AI-generated recipe based on your ingredients",
-                "ingredients": ingredients[:5],
-                "instructions": [recipe_text] if recipe_text else ["Mix ingredients and cook as desired."],
-                "prep_time": "15 minutes",
-                "cook_time": "20 minutes",
-                "servings": 2,
-                "difficulty": "Medium",
-                "cuisine": "Fusion",
-                "source": "AI Generated"
-            }
+            curated_recipes = self._get_curated_recipes(ingredients)
+            
+            ai_recipes = []
+            try:
+                recipe_text = await self._batcher.submit(self._encode_prompt(ingredients))
+                ai_recipes.append(self._build_ai_recipe(ingredients, recipe_text))
+            except Exception as e:
+                logger.error(f"Error in AI recipe generation: {e}")
+            
+            recipes = (curated_recipes + ai_recipes)[:3]
+            self._cache.put(cache_key, recipes)
+            return recipes
+            
+        except Exception as e:
+            logger.error(f"Error generating recipes: {e}")
+            return self._get_fallback_recipes()
+    
+    def _generate_ai_recipe(self, ingredients: List[str]) -> Dict[str, any]:
+        """Generate a recipe using the AI model"""
+        try:
+            recipe_text = self._generate_ai_texts([self._encode_prompt(ingredients)])[0]
+            return self._build_ai_recipe(ingredients, recipe_text)
             
         except Exception as e:
             logger.error(f"Error in AI recipe generation: {e}")
             return None
     
-    def _get_curated_recipes(self, ingredients: List[str]) -> List[Dict[str, any]]:
-        """Return curated recipes based on available ingredients"""
-        recipes_db = [
-            {
-                "id": 1,
-                "title": "Fresh Garden Salad",
-                "description": "A healthy and refreshing salad with fresh vegetables",
-                "ingredients": ["Lettuce", "Tomato", "Cucumber", "Onion", "Olive Oil", "Lemon"],
-                "instructions": [
-                    "Wash and chop all vegetables into bite-sized pieces",
-                    "Place lettuce in a large salad bowl as the base",
-                    "Add tomatoes, cucumber, and onion on top",
-                    "Drizzle with olive oil and fresh lemon juice",
-                    "Season with salt and pepper to taste",
-                    "Toss gently and serve immediately"
-                ],
-                "prep_time": "15 minutes",
-                "cook_time": "0 minutes",
-                "servings": 4,
-                "difficulty": "Easy",
-                "cuisine": "Mediterranean",
-                "source": "Curated"
-            },
-            {
-                "id": 2,
-                "title": "Vegetable Stir Fry",
-                "description": "Quick and healthy stir-fried vegetables",
-                "ingredients": ["Broccoli", "Carrot", "Bell Pepper", "Garlic", "Ginger", "Soy Sauce", "Oil"],
-                "instructions": [
-                    "Heat 2 tablespoons of oil in a large pan or wok over high heat",
-                    "Add minced garlic and ginger, stir-fry for 30 seconds until fragrant",
-                    "Add harder vegetables first (carrots, broccoli) and cook for 3-4 minutes",
-                    "Add softer vegetables (bell peppers) and cook for another 2 minutes",
-                    "Add soy sauce and stir everything together",
-                    "Cook for 1-2 more minutes until vegetables are tender-crisp",
-                    "Serve hot over rice or noodles"
-                ],
-                "prep_time": "10 minutes",
-                "cook_time": "10 minutes",
-                "servings": 3,
-                "difficulty": "Easy",
-                "cuisine": "Asian",
-                "source": "Curated"
-            },
-            {
-                "id": 3,
-                "title": "Fruit Smoothie Bowl",
-                "description": "Nutritious and delicious smoothie bowl",
-                "ingredients": ["Banana", "Strawberry", "Blueberry", "Milk", "Honey", "Granola"],
-                "instructions": [
-                    "Freeze fruits for at least 2 hours before making",
-                    "Add frozen banana and berries to a blender",
-                    "Pour in a small amount of milk and blend until smooth and thick",
-                    "Pour the smoothie into a bowl",
-                    "Top with fresh fruits, granola, and a drizzle of honey",
-                    "Add nuts or seeds if available",
-                    "Serve immediately with a spoon"
-                ],
-                "prep_time": "5 minutes",
-                "cook_time": "0 minutes",
-                "servings": 1,
-                "difficulty": "Easy",
-                "cuisine": "Healthy",
-                "source": "Curated"
-            },
-            {
-                "id": 4,
-                "title": "Scrambled Eggs with Vegetables",
-                "description": "Protein-rich breakfast with fresh vegetables",
-                "ingredients": ["Eggs", "Tomato", "Onion", "Pepper", "Cheese", "Butter", "Salt"],
-                "instructions": [
-                    "Crack 3-4 eggs into a bowl and whisk with salt and pepper",
-                    "Dice tomatoes, onions, and peppers into small pieces",
-                    "Heat butter in a non-stick pan over medium heat",
-                    "Add vegetables and cook for 3-4 minutes until softened",
-                    "Pour in the beaten eggs and let sit for 30 seconds",
-                    "Gently stir and scramble the eggs with the vegetables",
-                    "Add cheese in the last minute and fold in gently",
-                    "Serve hot with toast or bread"
-                ],
-                "prep_time": "8 minutes",
-                "cook_time": "7 minutes",
-                "servings": 2,
-                "difficulty": "Easy",
-                "cuisine": "American",
-                "source": "Curated"
-            },
-            {
-                "id": 5,
-                "title": "Roasted Vegetable Medley",
-                "description": "Colorful roasted vegetables with herbs",
-                "ingredients": ["Broccoli", "Bell Peppers", "Carrots", "Onions", "Olive Oil", "Herbs", "Salt"],
-                "instructions": [
-                    "Preheat oven to 425°F (220°C)",
-                    "Cut all vegetables into similar-sized pieces",
-                    "Toss vegetables with olive oil, salt, and herbs",
-                    "Spread on a large baking sheet in a single layer",
-                    "Roast for 25-30 minutes, stirring once halfway through",
-                    "Vegetables should be tender and lightly caramelized",
-                    "Serve as a side dish or over rice"
-                ],
-                "prep_time": "15 minutes",
-                "cook_time": "30 minutes",
-                "servings": 4,
-                "difficulty": "Easy",
-                "cuisine": "Mediterranean",
-                "source": "Curated"
-            },
-            {
-                "id": 6,
-                "title": "Fresh Vegetable Omelet",
-                "description": "Fluffy omelet packed with fresh vegetables",
-                "ingredients": ["Eggs", "Milk", "Cheese", "Tomatoes", "Onions", "Bell Peppers", "Herbs"],
-                "instructions": [
-                    "Beat 3 eggs with 2 tablespoons of milk",
-                    "Dice vegetables into small pieces",
-                    "Heat a non-stick pan over medium heat with a little oil",
-                    "Sauté vegetables for 2-3 minutes until softened",
-                    "Pour in the beaten eggs and let set for 1 minute",
-                    "Add cheese and herbs to one half of the omelet",
-                    "Fold the omelet in half and slide onto a plate",
-                    "Serve immediately while hot"
-                ],
-                "prep_time": "10 minutes",
-                "cook_time": "8 minutes",
-                "servings": 1,
-                "difficulty": "Medium",
-                "cuisine": "French",
-                "source": "Curated"
-            },
-            {
-                "id": 7,
-                "title": "Corn and Vegetable Soup",
-                "description": "Hearty soup with fresh corn and vegetables",
-                "ingredients": ["Corn", "Carrots", "Onions", "Broccoli", "Vegetable Broth", "Herbs", "Salt"],
-                "instructions": [
-                    "Heat oil in a large pot over medium heat",
-                    "Add diced onions and carrots, cook for 5 minutes",
-                    "Add corn kernels and cook for 3 minutes",
-                    "Pour in vegetable broth and bring to a boil",
-                    "Add broccoli and herbs, simmer for 10 minutes",
-                    "Season with salt and pepper to taste",
-                    "Serve hot with crusty bread"
-                ],
-                "prep_time": "15 minutes",
-                "cook_time": "20 minutes",
-                "servings": 4,
-                "difficulty": "Easy",
-                "cuisine": "American",
-                "source": "Curated"
-            },
-            {
-                "id": 8,
-                "title": "Cheese and Herb Frittata",
-                "description": "Baked egg dish with cheese and fresh herbs",
-                "ingredients": ["Eggs", "Milk", "Cheese", "Herbs", "Onions", "Butter", "Salt"],
-                "instructions": [
-                    "Preheat oven to 375°F (190°C)",
-                    "Beat 6 eggs with milk, salt, and pepper",
-                    "Heat butter in an oven-safe skillet over medium heat",
-                    "Add diced onions and cook until softened",
-                    "Pour in the egg mixture and add cheese and herbs",
-                    "Cook for 3-4 minutes until edges start to set",
-                    "Transfer to oven and bake for 12-15 minutes",
-                    "Cut into wedges and serve warm"
-                ],
-                "prep_time": "10 minutes",
-                "cook_time": "20 minutes",
-                "servings": 4,
-                "difficulty": "Medium",
-                "cuisine": "Italian",
-                "source": "Curated"
-            }
-        ]
+    def _token_ids(self, text: str) -> torch.Tensor:
+        """Token ids of text as a tensor on the model device"""
+        return torch.tensor(self.tokenizer.encode(text), dtype=torch.long, device=self.device)
+    
+    def _encode_ingredient(self, ingredient: str) -> torch.Tensor:
+        """Token ids of an ingredient as it appears in the prompt (after a space)"""
+        return self._token_ids(" " + ingredient)
+    
+    def _encode_prompt(self, ingredients: List[str]) -> torch.Tensor:
+        """Token ids of the generation prompt "Recipe with a, b, c:" for the given ingredients
         
-        # Filter recipes based on available ingredients
-        matching_recipes = []
-        ingredients_lower = [ing.lower() for ing in ingredients]
+        The prompt is assembled from cached token ids of its fixed pieces and
+        of each ingredient, so the tokenizer only runs for new ingredients.
+        """
+        pieces = [self._prompt_prefix_ids]
+        for i, ingredient in enumerate(ingredients[:5]):  # Limit to 5 ingredients
+            if i:
+                pieces.append(self._comma_ids)
+            pieces.append(self._ingredient_ids(ingredient))
+        pieces.append(self._colon_ids)
+        
+        return torch.cat(pieces)[:MAX_PROMPT_TOKENS]
+    
+    def _generate_ai_texts(self, prompts: List[torch.Tensor]) -> List[str]:
+        """Generate recipe texts for a batch of tokenized prompts in one pass"""
+        # Left-pad every prompt to the longest one so generation continues
+        # from the end of each row
+        length = max(len(prompt) for prompt in prompts)
+        
+        # The batch is assembled directly on the model device, where the
+        # prompt token ids already live
+        inputs = torch.full(
+            (len(prompts), length), self.tokenizer.pad_token_id, dtype=torch.long, device=self.device
+        )
+        attention_mask = torch.zeros((len(prompts), length), dtype=torch.long, device=self.device)
+        for row, prompt in enumerate(prompts):
+            inputs[row, length - len(prompt):] = prompt
+            attention_mask[row, length - len(prompt):] = 1
+        
+        # Generate
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                inputs,
+                attention_mask=attention_mask,
+                pad_token_id=self.tokenizer.eos_token_id,
+                **GENERATION_KWARGS
+            )
         
-        for recipe in recipes_db:
-            recipe_ingredients_lower = [ing.lower() for ing in recipe["ingredients"]]
-            matches = sum(1 for ing in recipe_ingredients_lower 
-                         if any(avail in ing or ing in avail for avail in ingredients_lower))
+        # Decode only the newly generated tokens
+        texts = self.tokenizer.batch_decode(outputs[:, length:], skip_special_tokens=True)
+        return [text.strip() for text in texts]
+    
+    def _build_ai_recipe(self, ingredients: List[str], recipe_text: str) -> Dict[str, any]:
+        """Wrap generated recipe text in the structured recipe format"""
+        return {
+            "id": 999,
+            "title": f"AI Recipe with {ingredients[0]}",
+            "description": "An AI-generated recipe based on your ingredients",
+            "ingredients": ingredients[:5],
+            "instructions": [recipe_text] if recipe_text else ["Mix ingredients and cook as desired."],
+            "prep_time": "15 minutes",
+            "cook_time": "20 minutes",
+            "servings": 2,
+            "difficulty": "Medium",
+            "cuisine": "Fusion",
+            "source": "AI Generated"
+        }
+    
+    def _rank_curated_recipes(self, ingredients: List[str]) -> List[Tuple[float, int, Dict[str, any]]]:
+        """Return (match score, matched count, recipe) for the best matching curated recipes"""
+        # Curated ingredients matched by any of the available ingredients
+        user_mask = 0
+        for ing in ingredients:
+            user_mask |= _matching_mask(ing.lower())
+        
+        # Filter recipes based on available ingredients
+        scored_recipes = []
+        for recipe, mask, count in zip(_RECIPES_DB, _RECIPE_MASKS, _RECIPE_POPCOUNT):
+            matches = (user_mask & mask).bit_count()
             
             if matches >= 1:  # At least 1 ingredient match
-                recipe["match_score"] = matches / len(recipe["ingredients"])
-                recipe["matched_ingredients"] = matches
-                matching_recipes.append(recipe)
+                scored_recipes.append((matches / count, matches, recipe))
         
-        # Sort by match score and return top recipes
-        matching_recipes.sort(key=lambda x: x.get("match_score", 0), reverse=True)
+        return heapq.nlargest(4, scored_recipes, key=lambda scored: scored[0])
+    
+    def _get_curated_recipes(self, ingredients: List[str]) -> List[Dict[str, any]]:
+        """Return curated recipes based on available ingredients"""
+        top_recipes = self._rank_curated_recipes(ingredients)
         
         # If we have good matches, return them, otherwise return some default recipes
-        if matching_recipes:
-            return matching_recipes[:4]
-        else:
-            return recipes_db[:3]  # Return first 3 as fallback
+        if not top_recipes:
+            return [dict(recipe) for recipe in _RECIPES_DB[:3]]  # Return first 3 as fallback
+        
+        return [
+            {**recipe, "match_score": score, "matched_ingredients": matches}
+            for score, matches, recipe in top_recipes
+        ]
+    
+    def _get_curated_recipes_json(self, ingredients: List[str]) -> List[bytes]:
+        """Return curated recipes as encoded JSON objects"""
+        top_recipes = self._rank_curated_recipes(ingredients)
+        
+        if not top_recipes:
+            return [_RECIPE_JSON_FRAGMENTS[recipe["id"]] + b"}" for recipe in _RECIPES_DB[:3]]
+        
+        return [
+            _RECIPE_JSON_FRAGMENTS[recipe["id"]]
+            + b',"match_score":' + orjson.dumps(score)
+            + b',"matched_ingredients":' + orjson.dumps(matches) + b"}"
+            for score, matches, recipe in top_recipes
+        ]
     
     def _get_fallback_recipes(self) -> List[Dict[str, any]]:
         """Return fallback recipes when no ingredients are detected"""
@@ -370,4 +621,20 @@ class RecipeGenerator:
                 "cuisine": "Asian",
                 "source": "Fallback"
             }
-        ] 
\ No newline at end of file
+        ] 
+
+_recipe_generator_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _build_recipe_generator() -> RecipeGenerator:
+    logger.info("Initializing recipe generator...")
+    return RecipeGenerator()
+
+def get_recipe_generator() -> RecipeGenerator:
+    """Return the process-wide recipe generator (its model is loaded separately by load_model)"""
+    with _recipe_generator_lock:
+        return _build_recipe_generator()
+
+def recipe_generator_loaded() -> bool:
+    """Whether the recipe generator's model has finished loading in this process"""
+    return _build_recipe_generator.cache_info().currsize > 0 and get_recipe_generator().model_loaded
\ No newline at end of file
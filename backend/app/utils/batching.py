@@ -0,0 +1,73 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+import asyncio
+
+from ..core.config import settings
+
+# Model inference gets its own small pool so concurrent batches don't thrash
+# the GIL and the model's BLAS threads, and so file I/O and other blocking
+# work on the default executor never queue behind a generate call
+inference_executor = ThreadPoolExecutor(
+    max_workers=settings.inference_threads, thread_name_prefix="inference"
+)
+
+class MicroBatcher:
+    """Group concurrent requests into batches for a blocking batch function
+
+    Items submitted within wait_ms of each other (up to max_batch of them) are
+    handed together to process_batch, which runs on the executor (the shared
+    inference pool by default) and must return one result per item.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch: int = 8, wait_ms: int = 8,
+                 executor: Optional[Executor] = None):
+        self.process_batch = process_batch
+        self.executor = executor or inference_executor
+        self.max_batch = max_batch
+        self.wait_ms = wait_ms
+        self._queue = None
+        self._worker_task = None
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item for the next batch and wait for its result"""
+        loop = asyncio.get_running_loop()
+
+        # Start the worker on first use (or if the event loop changed)
+        if self._worker_task is None or self._worker_task.done() or self._worker_task.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker_task = loop.create_task(self._worker())
+
+        future = loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _worker(self):
+        """Collect queued items into batches and process each batch in one call"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+
+            # Wait briefly for more requests to fill the batch
+            deadline = loop.time() + self.wait_ms / 1000
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.process_batch, [item for item, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator, Optional, Tuple
+import threading
+
+class LRUCache:
+    """Small thread-safe least-recently-used cache"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key (or None) and mark it as recently used"""
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any):
+        """Store value under key, evicting the least recently used entry if full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        """Snapshot of cached entries, most recently used last"""
+        with self._lock:
+            return iter(list(self._data.items()))
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -1,15 +1,32 @@
 from PIL import Image
+import io
 import cv2
 import numpy as np
 from pathlib import Path
 from fastapi import UploadFile
-from typing import Optional
+from typing import Any, Callable, Optional, Union, BinaryIO
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
 
 from ..core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Unsharp mask used to sharpen images for analysis (a separable Gaussian blur
+# instead of a dense 3x3 sharpening kernel, which caused ringing artifacts)
+SHARPEN_SIGMA = 1.0
+SHARPEN_AMOUNT = 0.5
+
+# Image decoding and resizing get their own pool so uploads are processed in
+# parallel instead of queueing behind model inference on the default executor
+image_executor = ThreadPoolExecutor(max_workers=settings.worker_cpu_threads, thread_name_prefix="image")
+
+async def run_image_task(func: Callable[..., Any], *args) -> Any:
+    """Run blocking image work on the shared image thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(image_executor, func, *args)
+
 def validate_image(file: UploadFile) -> bool:
     """Validate uploaded image file"""
     try:
@@ -20,43 +37,56 @@ def validate_image(file: UploadFile) -> bool:
                 logger.warning(f"Invalid file extension: {file_extension}")
                 return False
         
-        # Check file size
-        if file.size and file.size > settings.max_file_size:
-            logger.warning(f"File too large: {file.size} bytes")
-            return False
+        # The size limit is enforced while the upload is read, as file.size
+        # is only a hint (and None for streamed uploads)
         
         return True
     except Exception as e:
         logger.error(f"Error validating image: {e}")
         return False
 
-def process_image(image_path: str) -> str:
+def _prepare_image(image: Image.Image) -> Image.Image:
+    """Convert to RGB and downscale large images"""
+    # Convert to RGB if necessary
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    
+    # Resize if too large (for faster processing)
+    max_size = 1024
+    if max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    
+    return image
+
+def _load_image_array(source: Union[str, BinaryIO], debug_save_path: Optional[str]) -> np.ndarray:
+    """Load and prepare an image as an RGB uint8 (HWC) array"""
+    image = _prepare_image(Image.open(source))
+    
+    # Only write the processed image to disk when debugging
+    if debug_save_path:
+        image.save(debug_save_path, "JPEG", quality=85, optimize=False, progressive=False, subsampling=2)
+    
+    return np.asarray(image)
+
+def process_image(image_path: str, debug_save_path: Optional[str] = None) -> np.ndarray:
     """Process and optimize image for analysis"""
     try:
-        # Load image
-        image = Image.open(image_path)
-        
-        # Convert to RGB if necessary
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-        
-        # Resize if too large (for faster processing)
-        max_size = 1024
-        if max(image.size) > max_size:
-            ratio = max_size / max(image.size)
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Save processed image
-        processed_path = image_path.replace(".", "_processed.")
-        image.save(processed_path, "JPEG", quality=85)
-        
-        return processed_path
+        return _load_image_array(image_path, debug_save_path)
     except Exception as e:
         logger.error(f"Error processing image: {e}")
-        return image_path  # Return original path if processing fails
+        raise
 
-def enhance_image_for_analysis(image_path: str) -> Optional[str]:
+def process_image_bytes(data: Union[bytes, BinaryIO], debug_save_path: Optional[str] = None) -> np.ndarray:
+    """Process and optimize raw image bytes (or an open binary file) for analysis"""
+    try:
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+        return _load_image_array(data, debug_save_path)
+    except Exception as e:
+        logger.error(f"Error processing image: {e}")
+        raise
+
+def enhance_image_for_analysis(image_path: str, debug_save_path: Optional[str] = None) -> Optional[np.ndarray]:
     """Enhance image quality for better ingredient detection"""
     try:
         # Read image with OpenCV
@@ -64,27 +94,20 @@ def enhance_image_for_analysis(image_path: str) -> Optional[str]:
         if img is None:
             return None
         
-        # Convert to RGB
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Apply basic enhancements
-        # 1. Increase contrast slightly
+        # Sharpen (unsharp mask) and adjust contrast/brightness in one fused pass:
+        # alpha * ((1 + amount) * img - amount * blurred) + beta
         alpha = 1.1  # Contrast control
         beta = 10    # Brightness control
-        enhanced = cv2.convertScaleAbs(img_rgb, alpha=alpha, beta=beta)
-        
-        # 2. Apply slight sharpening
-        kernel = np.array([[-1,-1,-1],
-                          [-1, 9,-1],
-                          [-1,-1,-1]])
-        sharpened = cv2.filter2D(enhanced, -1, kernel)
+        blurred = cv2.GaussianBlur(img, (0, 0), SHARPEN_SIGMA)
+        enhanced = cv2.addWeighted(
+            img, (1 + SHARPEN_AMOUNT) * alpha, blurred, -SHARPEN_AMOUNT * alpha, beta
+        )
         
-        # Save enhanced image
-        enhanced_path = image_path.replace(".", "_enhanced.")
-        enhanced_pil = Image.fromarray(sharpened)
-        enhanced_pil.save(enhanced_path, "JPEG", quality=90)
+        # Only write the enhanced image to disk when debugging (OpenCV encodes BGR directly)
+        if debug_save_path:
+            cv2.imwrite(debug_save_path, enhanced, [cv2.IMWRITE_JPEG_QUALITY, 90])
         
-        return enhanced_path
+        return cv2.cvtColor(enhanced, cv2.COLOR_BGR2RGB)
     except Exception as e:
         logger.error(f"Error enhancing image: {e}")
         return None 
\ No newline at end of file
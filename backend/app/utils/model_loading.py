@@ -0,0 +1,56 @@
+from pathlib import Path
+import logging
+import os
+import shutil
+import tempfile
+
+from filelock import FileLock
+from huggingface_hub.constants import HF_HUB_CACHE
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+def _convert_to_safetensors(model_class, model_name: str, converted_dir: Path):
+    """Save a safetensors copy of a model into converted_dir
+
+    Workers starting together take turns on a file lock, so only the first
+    one loads the full checkpoint and the rest reuse its copy. The copy is
+    written to a temporary directory and renamed into place, so an
+    interrupted conversion never leaves a partially written model behind.
+    """
+    converted_dir.parent.mkdir(parents=True, exist_ok=True)
+    with FileLock(str(converted_dir) + ".lock"):
+        if converted_dir.exists():
+            logger.info(f"{model_name} was already converted by another process")
+            return
+
+        logger.info(f"Converting {model_name} to safetensors in {converted_dir}...")
+        tmp_dir = tempfile.mkdtemp(dir=converted_dir.parent, prefix=f".{converted_dir.name}-")
+        try:
+            model = model_class.from_pretrained(model_name, cache_dir=settings.model_cache_dir)
+            model.save_pretrained(tmp_dir, safe_serialization=True)
+            del model
+            os.replace(tmp_dir, converted_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def load_safetensors_model(model_class, model_name: str, **kwargs):
+    """Load a pretrained model from safetensors weights
+
+    Safetensors files load quickly and without unpickling. Models that only
+    ship PyTorch pickles are converted once into the model cache directory
+    (the Hugging Face cache unless MODEL_CACHE_DIR is set) and loaded from
+    there afterwards.
+    """
+    try:
+        return model_class.from_pretrained(model_name, use_safetensors=True, **kwargs)
+    except OSError:
+        logger.info(f"No safetensors weights published for {model_name}")
+
+    converted_dir = Path(settings.model_cache_dir or HF_HUB_CACHE) / "safetensors" / model_name.replace("/", "--")
+    if not converted_dir.exists():
+        _convert_to_safetensors(model_class, model_name, converted_dir)
+
+    kwargs.pop("cache_dir", None)
+    return model_class.from_pretrained(converted_dir, use_safetensors=True, **kwargs)
@@ -0,0 +1,43 @@
+import logging
+
+import torch
+from torch import nn
+from transformers.pytorch_utils import Conv1D
+
+logger = logging.getLogger(__name__)
+
+def _conv1d_to_linear(conv: Conv1D) -> nn.Linear:
+    """nn.Linear equivalent of a GPT-2 style Conv1D (which stores its weight transposed)"""
+    in_features, out_features = conv.weight.shape
+    linear = nn.Linear(in_features, out_features, device=conv.weight.device, dtype=conv.weight.dtype)
+    with torch.no_grad():
+        linear.weight.copy_(conv.weight.t())
+        linear.bias.copy_(conv.bias)
+    return linear
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    """INT8 dynamic quantization of a model's Linear layers, in place
+
+    GPT-2 blocks are built from transformers' Conv1D rather than nn.Linear,
+    so those are converted first (quantize_dynamic would skip them otherwise).
+    The output embedding is left alone, as it's usually tied to the input
+    embedding and quantizing it would add an untied copy of those weights.
+    """
+    conv_layers = [
+        (parent, name)
+        for parent in model.modules()
+        for name, child in parent.named_children()
+        if isinstance(child, Conv1D)
+    ]
+    for parent, name in conv_layers:
+        setattr(parent, name, _conv1d_to_linear(getattr(parent, name)))
+
+    output_embeddings = model.get_output_embeddings() if hasattr(model, "get_output_embeddings") else None
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and module is not output_embeddings
+    }
+    logger.info(f"Quantizing {len(qconfig_spec)} linear layers to INT8 ({len(conv_layers)} converted from Conv1D)")
+
+    return torch.ao.quantization.quantize_dynamic(model, qconfig_spec, inplace=True)
@@ -4,18 +4,28 @@ RecipeSnap Backend Server
 Run this script to start the FastAPI server
 """
 
+import importlib.util
+
 import uvicorn
 
+from app.core.config import settings
+
 if __name__ == "__main__":
     print("🍳 Starting RecipeSnap API Server...")
     print("📖 API Documentation: http://localhost:8000/docs")
     print("🔍 Health Check: http://localhost:8000/api/v1/health")
     print("⚡ Press Ctrl+C to stop the server")
     
+    # DEV=1 runs a single auto-reloading worker; otherwise one worker per CPU
+    # (override with WORKERS). uvloop/httptools ship with uvicorn[standard]
+    # but aren't available on Windows.
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=settings.dev,
+        workers=settings.server_workers,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "auto",
+        http="httptools" if importlib.util.find_spec("httptools") else "auto",
         log_level="info"
     ) 
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""Curated recipe matching must rank recipes exactly like the original substring scoring"""
+import copy
+import random
+
+import pytest
+
+from app.models.recipe_generator import RecipeGenerator, _RECIPES_DB
+
+
+def _reference_curated_recipes(ingredients):
+    """The original (per-recipe substring) matching, kept as the reference"""
+    recipes_db = copy.deepcopy(list(_RECIPES_DB))
+    matching_recipes = []
+    ingredients_lower = [ing.lower() for ing in ingredients]
+
+    for recipe in recipes_db:
+        recipe_ingredients_lower = [ing.lower() for ing in recipe["ingredients"]]
+        matches = sum(1 for ing in recipe_ingredients_lower
+                      if any(avail in ing or ing in avail for avail in ingredients_lower))
+
+        if matches >= 1:
+            recipe["match_score"] = matches / len(recipe["ingredients"])
+            recipe["matched_ingredients"] = matches
+            matching_recipes.append(recipe)
+
+    matching_recipes.sort(key=lambda x: x.get("match_score", 0), reverse=True)
+
+    if matching_recipes:
+        return matching_recipes[:4]
+    return recipes_db[:3]
+
+
+def _summary(recipes):
+    return [(r["id"], r.get("match_score"), r.get("matched_ingredients")) for r in recipes]
+
+
+def _candidate_words():
+    vocabulary = sorted({ing for recipe in _RECIPES_DB for ing in recipe["ingredients"]})
+    words = list(vocabulary)
+    words += [ing.upper() for ing in vocabulary] + [ing.lower() for ing in vocabulary]
+    # Fragments and superstrings exercise both substring directions
+    words += [ing[:3] for ing in vocabulary] + [ing[1:-1] for ing in vocabulary]
+    words += [f"Fresh {ing}" for ing in vocabulary] + [f"{ing}s" for ing in vocabulary]
+    words += ["Chicken", "Rice", "Vegetables", "Fruits", "Fresh", "oil", "pepper", "egg", "a", "", "xyz"]
+    return words
+
+
+@pytest.fixture(scope="module")
+def generator():
+    return RecipeGenerator()
+
+
+def test_rankings_match_reference(generator):
+    rng = random.Random(0)
+    words = _candidate_words()
+    for _ in range(20000):
+        ingredients = rng.sample(words, rng.randint(1, 8))
+        assert _summary(generator._get_curated_recipes(ingredients)) == \
+            _summary(_reference_curated_recipes(ingredients)), ingredients
+
+
+def test_json_rankings_match_reference(generator):
+    import orjson
+
+    rng = random.Random(1)
+    words = _candidate_words()
+    for _ in range(2000):
+        ingredients = rng.sample(words, rng.randint(1, 8))
+        recipes = [orjson.loads(fragment) for fragment in generator._get_curated_recipes_json(ingredients)]
+        assert _summary(recipes) == _summary(_reference_curated_recipes(ingredients)), ingredients